@@ -11,104 +11,174 @@ import sys
 from pathlib import Path
 
 try:
-    import torch
-    from transformers import T5Tokenizer, T5ForConditionalGeneration
+    from transformers import T5TokenizerFast
     import onnx
+    import onnxoptimizer
     from onnxsim import simplify
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from onnxruntime.transformers.optimizer import optimize_model
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
 except ImportError as e:
     print(f"Error: Required library not installed: {e}")
-    print("Install with: pip install torch transformers onnx onnx-simplifier")
+    print("Install with: pip install torch transformers onnx onnx-simplifier "
+          "onnxoptimizer onnxruntime optimum[onnxruntime]")
     sys.exit(1)
 
 
-def convert_to_onnx(model_path, output_path="model.onnx", simplify_model=True):
+def simplify_graph(graph_path):
+    """Fuse and simplify one ONNX graph.
+
+    Returns the path of the simplified copy, or None if simplification
+    failed or did not validate.
+    """
+    try:
+        onnx_model = onnx.load(graph_path)
+        # Fuse operators before simplification so simplify sees the
+        # smaller graph.
+        onnx_model = onnxoptimizer.optimize(onnx_model, [
+            'fuse_bn_into_conv',
+            'fuse_matmul_add_bias_into_gemm',
+            'eliminate_identity',
+        ])
+        model_simp, check = simplify(onnx_model)
+        if not check:
+            print(f"⚠ Simplification validation failed for {graph_path.name}, "
+                  "keeping original")
+            return None
+        simplified_path = graph_path.with_name(
+            graph_path.stem + '_simplified.onnx')
+        onnx.save(model_simp, simplified_path)
+        original_size = graph_path.stat().st_size / (1024 * 1024)
+        simplified_size = simplified_path.stat().st_size / (1024 * 1024)
+        print(f"✓ {graph_path.name}: {original_size:.2f} MB -> "
+              f"{simplified_size:.2f} MB simplified")
+        return simplified_path
+    except Exception as e:
+        print(f"⚠ Simplification failed for {graph_path.name}: {e}")
+        return None
+
+
+def optimize_graph(graph_path):
+    """Run ONNX Runtime transformer fusions on one graph in place.
+
+    Fuses attention and layer-norm subgraphs into single ops and
+    constant-folds more aggressively than onnxsim alone. The graph stays
+    fp32 — tract runs on CPU, so there is no point converting to fp16 here.
+    """
+    try:
+        opt = optimize_model(
+            str(graph_path),
+            model_type='t5',
+            opt_level=99,
+            use_gpu=False,
+        )
+        opt.save_model_to_file(str(graph_path))
+        print(f"✓ {graph_path.name}: transformer fusions applied")
+    except Exception as e:
+        print(f"⚠ Optimization failed for {graph_path.name}: {e}")
+        print("Keeping unfused graph")
+
+
+def quantize_graph(graph_path):
+    """Dynamically quantize one ONNX graph to INT8 in place.
+
+    The fp32 graph is kept next to it as a .fp32.onnx fallback.
+    """
+    fp32_path = graph_path.with_name(graph_path.stem + '.fp32.onnx')
+    try:
+        graph_path.replace(fp32_path)
+        quantize_dynamic(
+            fp32_path,
+            graph_path,
+            weight_type=QuantType.QInt8,
+            op_types_to_quantize=['MatMul', 'Gemm'],
+        )
+        quantized_size = graph_path.stat().st_size / (1024 * 1024)
+        print(f"✓ {graph_path.name}: quantized to {quantized_size:.2f} MB "
+              f"(fp32 kept at {fp32_path.name})")
+    except Exception as e:
+        print(f"⚠ Quantization failed for {graph_path.name}: {e}")
+        print("Keeping FP32 model")
+        if not graph_path.exists() and fp32_path.exists():
+            fp32_path.replace(graph_path)
+
+
+def convert_to_onnx(model_path, output_dir="onnx-model", simplify_model=True,
+                    replace_original=False):
     """Convert model to ONNX format."""
+    output_dir = Path(output_dir)
     print("=" * 80)
     print("ONNX CONVERSION")
     print("=" * 80)
     print(f"Input model: {model_path}")
-    print(f"Output file: {output_path}")
+    print(f"Output directory: {output_dir}")
     print("=" * 80)
     print()
 
-    # Load model and tokenizer
-    print("Loading model and tokenizer...")
+    # Export via Optimum, which splits the model into encoder, decoder and
+    # decoder-with-past graphs. The separate decoder-with-past graph is what
+    # lets the deployed runtime reuse the KV cache during autoregressive
+    # decoding instead of re-running the full sequence every step.
+    print("Loading model and exporting to ONNX...")
     try:
-        model = T5ForConditionalGeneration.from_pretrained(model_path)
-        tokenizer = T5Tokenizer.from_pretrained(model_path)
-    except Exception as e:
-        print(f"Error loading model: {e}")
-        print("\nMake sure the model path contains a valid Transformers model.")
-        sys.exit(1)
-
-    model.eval()
-
-    # Create dummy input
-    print("Creating dummy input...")
-    dummy_text = "translate to command: list files"
-    dummy_input = tokenizer(dummy_text, return_tensors="pt", padding=True)
-    input_ids = dummy_input['input_ids']
-    attention_mask = dummy_input['attention_mask']
-
-    # Export to ONNX
-    print("Exporting to ONNX format...")
-    try:
-        with torch.no_grad():
-            torch.onnx.export(
-                model,
-                (input_ids, attention_mask),
-                output_path,
-                input_names=['input_ids', 'attention_mask'],
-                output_names=['output'],
-                dynamic_axes={
-                    'input_ids': {0: 'batch_size', 1: 'sequence'},
-                    'attention_mask': {0: 'batch_size', 1: 'sequence'},
-                    'output': {0: 'batch_size', 1: 'sequence'}
-                },
-                opset_version=14,
-                do_constant_folding=True,
-                verbose=False
-            )
-        print(f"✓ Model exported to: {output_path}")
+        ort_model = ORTModelForSeq2SeqLM.from_pretrained(model_path, export=True)
+        tokenizer = T5TokenizerFast.from_pretrained(model_path)
     except Exception as e:
         print(f"Error during export: {e}")
+        print("\nMake sure the model path contains a valid Transformers model.")
         sys.exit(1)
 
-    # Get model size
-    onnx_size = Path(output_path).stat().st_size / (1024 * 1024)  # MB
-    print(f"  Model size: {onnx_size:.2f} MB")
-
-    # Simplify model (optional)
+    ort_model.save_pretrained(output_dir)
+    # Only the exporter's canonical graphs: a bare glob would also pick up
+    # .fp32.onnx / _simplified.onnx artifacts left by a previous run into the
+    # same directory and re-process them.
+    graphs = [
+        output_dir / name
+        for name in (
+            "encoder_model.onnx",
+            "decoder_model.onnx",
+            "decoder_with_past_model.onnx",
+        )
+        if (output_dir / name).exists()
+    ]
+    print(f"✓ Exported {len(graphs)} graphs to: {output_dir}")
+    for graph in graphs:
+        size = graph.stat().st_size / (1024 * 1024)
+        print(f"  {graph.name}: {size:.2f} MB")
+
+    # Simplify graphs (optional)
     if simplify_model:
-        print("\nSimplifying ONNX model...")
-        try:
-            onnx_model = onnx.load(output_path)
-            model_simp, check = simplify(onnx_model)
-
-            if check:
-                simplified_path = str(output_path).replace('.onnx', '_simplified.onnx')
-                onnx.save(model_simp, simplified_path)
-                simplified_size = Path(simplified_path).stat().st_size / (1024 * 1024)
-                print(f"✓ Simplified model saved to: {simplified_path}")
-                print(f"  Simplified size: {simplified_size:.2f} MB")
-                print(f"  Size reduction: {onnx_size - simplified_size:.2f} MB")
-
-                # Optionally replace original with simplified
-                print("\nReplace original with simplified version? (y/n): ", end="")
-                response = input().strip().lower()
-                if response == 'y':
-                    Path(simplified_path).replace(output_path)
-                    print(f"✓ Replaced {output_path} with simplified version")
+        print("\nSimplifying ONNX graphs...")
+        simplified = [(g, s) for g in graphs
+                      if (s := simplify_graph(g)) is not None]
+        # No interactive prompt here: conversion has to run unattended in CI,
+        # so replacement is opt-in via --replace-original and the default
+        # keeps both files.
+        if simplified:
+            if replace_original:
+                for graph, simplified_path in simplified:
+                    simplified_path.replace(graph)
+                print("✓ Replaced originals with simplified versions")
             else:
-                print("⚠ Simplification validation failed, keeping original")
-        except Exception as e:
-            print(f"⚠ Simplification failed: {e}")
-            print("Keeping original model")
+                print("Keeping originals; simplified copies saved alongside "
+                      "(pass --replace-original to overwrite)")
+
+    # Apply ONNX Runtime's transformer-specific fusions on top of the
+    # generic simplification above.
+    print("\nApplying transformer fusions...")
+    for graph in graphs:
+        optimize_graph(graph)
+
+    # Quantize weights to INT8. tract runs on CPU, where int8 matmuls roughly
+    # double throughput and halve the model size, so the quantized graphs
+    # become the primary artifacts and fp32 is kept as a fallback.
+    print("\nQuantizing graphs to INT8...")
+    for graph in graphs:
+        quantize_graph(graph)
 
     # Save tokenizer
-    tokenizer_dir = Path(output_path).parent / "tokenizer"
-    print(f"\nSaving tokenizer to: {tokenizer_dir}")
-    tokenizer.save_pretrained(tokenizer_dir)
+    print(f"\nSaving tokenizer to: {output_dir}")
+    tokenizer.save_pretrained(output_dir)
     print(f"✓ Tokenizer saved")
 
     # Print usage instructions
@@ -116,14 +186,13 @@ def convert_to_onnx(model_path, output_path="model.onnx", simplify_model=True):
     print("CONVERSION COMPLETE!")
     print("=" * 80)
     print(f"\nTo use with Eidos:")
-    print(f"  1. Copy {output_path} to your Eidos directory")
-    print(f"  2. Copy {tokenizer_dir}/tokenizer.json to your Eidos directory")
-    print(f"  3. Configure in eidos.toml:")
-    print(f"     model_path = \"{Path(output_path).name}\"")
-    print(f"     tokenizer_path = \"tokenizer.json\"")
+    print(f"  1. Copy the {output_dir}/ directory to your Eidos directory")
+    print(f"  2. Configure in eidos.toml:")
+    print(f"     model_path = \"{output_dir.name}\"")
+    print(f"     tokenizer_path = \"{output_dir.name}/tokenizer.json\"")
     print(f"\nOr set environment variables:")
-    print(f"  export EIDOS_MODEL_PATH={Path(output_path).absolute()}")
-    print(f"  export EIDOS_TOKENIZER_PATH={tokenizer_dir.absolute()}/tokenizer.json")
+    print(f"  export EIDOS_MODEL_PATH={output_dir.absolute()}")
+    print(f"  export EIDOS_TOKENIZER_PATH={output_dir.absolute()}/tokenizer.json")
 
 
 def main():
@@ -136,14 +205,19 @@ def main():
     )
     parser.add_argument(
         '-o', '--output',
-        default='model.onnx',
-        help="Output ONNX file path (default: model.onnx)"
+        default='onnx-model',
+        help="Output directory for ONNX graphs (default: onnx-model)"
     )
     parser.add_argument(
         '--no-simplify',
         action='store_true',
         help="Skip ONNX model simplification"
     )
+    parser.add_argument(
+        '--replace-original',
+        action='store_true',
+        help="Overwrite unsimplified graphs with their simplified versions"
+    )
 
     args = parser.parse_args()
 
@@ -154,7 +228,8 @@ def main():
     convert_to_onnx(
         args.model_path,
         args.output,
-        simplify_model=not args.no_simplify
+        simplify_model=not args.no_simplify,
+        replace_original=args.replace_original
     )
 
 
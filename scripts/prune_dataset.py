@@ -1,24 +1,162 @@
+import mmap
+import multiprocessing
 import os
+import shutil
+import subprocess
+import tempfile
+
+try:
+    import pydeduplines
+except ImportError:
+    pydeduplines = None
+
+try:
+    import xxhash
+    # Stable 64-bit digest, same scheme runiq's digest filter uses.
+    _line_hash = xxhash.xxh3_64_intdigest
+except ImportError:
+    _line_hash = hash
+
+def _keep_line(line):
+    """Word-count filter: keep lines with at least 5 whitespace-split words.
+
+    split() is deliberate: counting separator bytes instead miscounts on the
+    indented, run-spaced man-page corpus, where leading indentation alone can
+    push a near-empty line over the threshold.
+    """
+    return len(line.split()) >= 5
+
+
+def _scan_lines(mm):
+    """Yield lines (newline included) from a memory-mapped file."""
+    size = len(mm)
+    start = 0
+    while start < size:
+        end = mm.find(b'\n', start)
+        stop = size if end == -1 else end + 1
+        yield mm[start:stop]
+        start = stop
+
+
+def _dedup_lines_native(input_file, unique_file, workdir):
+    """Write the unique lines of input_file to unique_file.
+
+    Prefers the Rust-backed pydeduplines extension (multi-threaded, splits the
+    input across cores), then the runiq CLI with 64-bit digests. Returns False
+    when neither backend is available.
+    """
+    if pydeduplines is not None:
+        pydeduplines.compute_unique_lines(
+            workdir,
+            [input_file],
+            unique_file,
+            number_of_splits=16,
+            number_of_threads=0,
+        )
+        return True
+
+    if shutil.which('runiq'):
+        with open(unique_file, 'wb') as f_out:
+            subprocess.run(
+                ['runiq', '-f', 'digest', input_file],
+                stdout=f_out,
+                check=True,
+            )
+        return True
+
+    return False
+
+
+def _prune_shard(paths):
+    """Dedup and filter one shard, returning the number of lines kept.
+
+    Runs in a worker process; dedup is purely shard-local because the parent
+    hash-partitioned the input, so duplicates always share a shard.
+    """
+    shard_file, out_file = paths
+    seen = set()
+    kept = 0
+    with open(shard_file, 'rb') as f_in, open(out_file, 'wb') as f_out:
+        for line in f_in:
+            # Cheap filter first so short lines never touch the hash set.
+            if not _keep_line(line):
+                continue
+            h = _line_hash(line)
+            if h not in seen:
+                seen.add(h)
+                f_out.write(line)
+                kept += 1
+    return kept
+
+
+def _prune_python_parallel(input_file, output_file, workdir):
+    """Pure-Python fallback: hash-partition into shards, prune in parallel.
+
+    The input is memory-mapped and streamed once, routing each line to
+    shard hash(line) % N. Workers dedup and filter their shards
+    independently; the shard outputs are then concatenated. Returns the
+    number of lines kept.
+    """
+    if os.path.getsize(input_file) == 0:
+        open(output_file, 'wb').close()
+        return 0
+
+    n_shards = os.cpu_count() or 1
+    shard_paths = [
+        os.path.join(workdir, f"shard_{i}.txt") for i in range(n_shards)
+    ]
+    out_paths = [path + ".out" for path in shard_paths]
+
+    shards = [open(path, 'wb') for path in shard_paths]
+    try:
+        with open(input_file, 'rb') as f_in:
+            mm = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for line in _scan_lines(mm):
+                    shards[_line_hash(line) % n_shards].write(line)
+            finally:
+                mm.close()
+    finally:
+        for shard in shards:
+            shard.close()
+
+    with multiprocessing.Pool(n_shards) as pool:
+        kept_counts = pool.map(_prune_shard, list(zip(shard_paths, out_paths)))
+
+    with open(output_file, 'wb') as f_out:
+        for path in out_paths:
+            with open(path, 'rb') as f_in:
+                shutil.copyfileobj(f_in, f_out)
+
+    return sum(kept_counts)
+
 
 def prune_dataset(input_file, output_file):
     if not os.path.exists(input_file):
         print(f"Error: Input file '{input_file}' not found.")
         return
 
-    with open(input_file, 'r', encoding='utf-8') as f_in:
-        lines = f_in.readlines()
-        
-    unique_lines = sorted(list(set(lines)))
-    
-    with open(output_file, 'w', encoding='utf-8') as f_out:
-        for line in unique_lines:
-            if len(line.split()) >= 5:
-                f_out.write(line)
+    with tempfile.TemporaryDirectory() as workdir:
+        unique_file = os.path.join(workdir, 'unique.txt')
+        if _dedup_lines_native(input_file, unique_file, workdir):
+            # Second streaming pass over the native backend's output: keep
+            # only lines with enough words to be useful training examples.
+            # Output order is not significant.
+            kept = 0
+            with open(unique_file, 'rb') as f_in, \
+                 open(output_file, 'wb') as f_out:
+                for line in f_in:
+                    if _keep_line(line):
+                        f_out.write(line)
+                        kept += 1
+        else:
+            kept = _prune_python_parallel(input_file, output_file, workdir)
+
+    print(f"Dataset pruned successfully. {kept} lines saved to '{output_file}'.")
 
-    print(f"Dataset pruned successfully. Pruned data saved to '{output_file}'.")
 
 if __name__ == "__main__":
     input_path = os.path.join("..", "data", "SLM-training-data.txt")
     output_path = os.path.join("..", "data", "SLM-training-data-pruned.txt")
-    
+
     prune_dataset(input_path, output_path)
@@ -8,16 +8,23 @@ checking both accuracy and safety.
 
 import json
 import argparse
+import re
 from pathlib import Path
 import sys
 
 try:
-    from transformers import pipeline
+    import torch
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
 except ImportError:
     print("Error: transformers library not installed")
     print("Install with: pip install transformers torch")
     sys.exit(1)
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 # Dangerous patterns that should never be generated
 DANGEROUS_PATTERNS = [
@@ -34,23 +41,37 @@ DANGEROUS_PATTERNS = [
     '/dev/null 2>&1',
 ]
 
+# Single compiled alternation so a command is scanned once instead of once per
+# pattern. Each pattern gets its own group so the match can be traced back to
+# the entry in DANGEROUS_PATTERNS it came from.
+_DANGER_RE = re.compile(
+    '|'.join(f'({re.escape(p)})' for p in DANGEROUS_PATTERNS),
+    re.IGNORECASE
+)
+
+
+def _dumps_line(record):
+    """Serialize one result record to a JSONL line as bytes."""
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return (json.dumps(record) + "\n").encode('utf-8')
+
 
 def load_test_cases(file_path):
     """Load test cases from JSONL file."""
-    test_cases = []
-    with open(file_path, 'r') as f:
-        for line in f:
-            if line.strip():
-                test_cases.append(json.loads(line))
-    return test_cases
+    # orjson parses straight from bytes and is several times faster than
+    # stdlib json; fall back to json.loads when it isn't installed.
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(file_path, 'rb') as f:
+        return [loads(line) for line in f if line.strip()]
 
 
 def validate_safety(command):
     """Check if command contains dangerous patterns."""
-    command_lower = command.lower()
-    for pattern in DANGEROUS_PATTERNS:
-        if pattern.lower() in command_lower:
-            return False, f"Contains dangerous pattern: {pattern}"
+    match = _DANGER_RE.search(command)
+    if match:
+        pattern = DANGEROUS_PATTERNS[match.lastindex - 1]
+        return False, f"Contains dangerous pattern: {pattern}"
     return True, None
 
 
@@ -58,7 +79,18 @@ def validate_model(model_path, test_file, verbose=False):
     """Validate model accuracy and safety."""
     print(f"Loading model from: {model_path}")
     try:
-        generator = pipeline('text2text-generation', model=model_path)
+        # Ask for the Rust-backed fast tokenizer explicitly so batch
+        # tokenization never falls back to the slow SentencePiece wrapper.
+        tokenizer = AutoTokenizer.from_pretrained(model_path, use_fast=True)
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        # bf16 halves the weight bytes read per forward pass, which is what
+        # bounds small-batch inference; stay fp32 on CPUs without bf16 GPUs.
+        use_bf16 = torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+        dtype = torch.bfloat16 if use_bf16 else torch.float32
+        model = AutoModelForSeq2SeqLM.from_pretrained(
+            model_path, torch_dtype=dtype
+        )
+        model = model.to(device).eval()
     except Exception as e:
         print(f"Error loading model: {e}")
         return
@@ -69,58 +101,83 @@ def validate_model(model_path, test_file, verbose=False):
 
     correct = 0
     safety_failures = 0
-    results = []
-
-    for i, case in enumerate(test_cases, 1):
-        prompt = case['prompt']
-        expected = case['command'].strip()
-
-        # Generate prediction
-        try:
-            result = generator(
-                f"translate to command: {prompt}",
-                max_length=64,
-                num_return_sequences=1
-            )
-            predicted = result[0]['generated_text'].strip()
-        except Exception as e:
-            predicted = f"ERROR: {e}"
-
-        # Check accuracy
-        is_correct = predicted == expected
-
-        # Check safety
-        is_safe, safety_issue = validate_safety(predicted)
-
-        if is_correct:
-            correct += 1
-            status = "✓"
-        else:
-            status = "✗"
-
-        if not is_safe:
-            safety_failures += 1
-            status += " ⚠ UNSAFE"
-
-        results.append({
-            'prompt': prompt,
-            'expected': expected,
-            'predicted': predicted,
-            'correct': is_correct,
-            'safe': is_safe,
-            'safety_issue': safety_issue
-        })
-
-        if verbose or not is_correct or not is_safe:
-            print(f"{status} [{i}/{len(test_cases)}] {prompt}")
-            if not is_correct:
-                print(f"  Expected:  {expected}")
-                print(f"  Predicted: {predicted}")
+
+    # Generate predictions with model.generate directly in fixed-size batches.
+    # This skips the per-call tokenize/allocate overhead of the pipeline
+    # wrapper; use_cache reuses past KV states across decode steps.
+    prompts = [f"translate to command: {case['prompt']}" for case in test_cases]
+    predictions = []
+    batch_size = 32
+    with torch.inference_mode():
+        for start in range(0, len(prompts), batch_size):
+            batch = prompts[start:start + batch_size]
+            # Degrade per batch: a failure (e.g. OOM) marks only this
+            # batch's cases and the remaining batches still run.
+            try:
+                enc = tokenizer(
+                    batch,
+                    padding=True,
+                    truncation=True,
+                    max_length=128,
+                    return_tensors='pt'
+                ).to(device)
+                out = model.generate(
+                    **enc,
+                    max_new_tokens=64,
+                    use_cache=True,
+                    num_beams=1
+                )
+                predictions.extend(
+                    text.strip() for text in
+                    tokenizer.batch_decode(out, skip_special_tokens=True)
+                )
+            except Exception as e:
+                predictions.extend([f"ERROR: {e}"] * len(batch))
+
+    # Stream per-case records to JSONL as they are scored instead of holding
+    # them all in memory for one big dump at the end. This keeps memory flat
+    # on large test sets and leaves partial results behind if the run dies.
+    results_file = Path(model_path).parent / "validation_results.jsonl"
+    with open(results_file, 'wb') as results_out:
+        for i, (case, predicted) in enumerate(zip(test_cases, predictions), 1):
+            prompt = case['prompt']
+            expected = case['command'].strip()
+
+            # Check accuracy
+            is_correct = predicted == expected
+
+            # Check safety
+            is_safe, safety_issue = validate_safety(predicted)
+
+            if is_correct:
+                correct += 1
+                status = "✓"
+            else:
+                status = "✗"
+
             if not is_safe:
-                print(f"  Safety Issue: {safety_issue}")
-            if verbose and is_correct:
-                print(f"  Command: {predicted}")
-            print()
+                safety_failures += 1
+                status += " ⚠ UNSAFE"
+
+            results_out.write(_dumps_line({
+                'prompt': prompt,
+                'expected': expected,
+                'predicted': predicted,
+                'correct': is_correct,
+                'safe': is_safe,
+                'safety_issue': safety_issue
+            }))
+
+            if verbose or not is_correct or not is_safe:
+                print(f"{status} [{i}/{len(test_cases)}] {prompt}")
+                if not is_correct:
+                    print(f"  Expected:  {expected}")
+                    print(f"  Predicted: {predicted}")
+                if not is_safe:
+                    print(f"  Safety Issue: {safety_issue}")
+                if verbose and is_correct:
+                    print(f"  Command: {predicted}")
+                print()
 
     # Print summary
     print("=" * 80)
@@ -142,20 +199,24 @@ def validate_model(model_path, test_file, verbose=False):
         print("  - Longer training time")
         print("  - Different base model")
 
-    # Save detailed results
-    results_file = Path(model_path).parent / "validation_results.json"
-    with open(results_file, 'w') as f:
-        json.dump({
-            'summary': {
-                'total': len(test_cases),
-                'correct': correct,
-                'accuracy': accuracy,
-                'safety_failures': safety_failures
-            },
-            'results': results
-        }, f, indent=2)
+    # Save the small aggregate summary; the per-case records were already
+    # streamed to the JSONL file above.
+    summary_file = Path(model_path).parent / "validation_results_summary.json"
+    summary = {
+        'total': len(test_cases),
+        'correct': correct,
+        'accuracy': accuracy,
+        'safety_failures': safety_failures
+    }
+    if orjson is not None:
+        with open(summary_file, 'wb') as f:
+            f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
+    else:
+        with open(summary_file, 'w') as f:
+            json.dump(summary, f, indent=2)
 
     print(f"\nDetailed results saved to: {results_file}")
+    print(f"Summary saved to: {summary_file}")
 
     return accuracy, safety_failures
 